@@ -45,10 +45,12 @@ class APIClient {
         let recording: Bool
     }
 
-    func getLevel() async throws -> LevelResponse {
-        let url = URL(string: "\(baseURL)/level")!
-        let (data, _) = try await session.data(from: url)
-        return try JSONDecoder().decode(LevelResponse.self, from: data)
+    /// Opens /ws/level; the backend pushes a LevelResponse per audio block while recording
+    func levelSocket() -> URLSessionWebSocketTask {
+        let url = URL(string: "\(baseURL.replacingOccurrences(of: "http", with: "ws", options: .anchored))/ws/level")!
+        let task = session.webSocketTask(with: url)
+        task.resume()
+        return task
     }
 
     // MARK: - Recording
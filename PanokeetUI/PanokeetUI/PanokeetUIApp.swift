@@ -28,7 +28,7 @@ class AppState: ObservableObject {
     let apiClient = APIClient()
     var popupWindow: NSWindow?
     var pollTimer: Timer?
-    var levelTimer: Timer?
+    var levelSocket: URLSessionWebSocketTask?
     var previousApp: NSRunningApplication?
     var backendFailCount = 0
 
@@ -89,7 +89,7 @@ class AppState: ObservableObject {
                         // Just stopped recording - SwiftUI will update automatically
                         status = .transcribing
                         NSSound(named: "Tink")?.play()
-                        stopLevelPolling()
+                        stopLevelUpdates()
                     }
                 }
 
@@ -130,7 +130,7 @@ class AppState: ObservableObject {
         }
 
         NSApp.activate(ignoringOtherApps: true)
-        startLevelPolling()
+        startLevelUpdates()
 
         let panel = FloatingPanel()
 
@@ -155,39 +155,41 @@ class AppState: ObservableObject {
     }
 
     func closePopup() {
-        stopLevelPolling()
+        stopLevelUpdates()
         popupWindow?.close()
         popupWindow = nil
         status = .ready
         refocusPreviousApp()
     }
 
-    func startLevelPolling() {
+    func startLevelUpdates() {
         levelHistory = Array(repeating: 0, count: 30)
-        levelTimer = Timer.scheduledTimer(withTimeInterval: 0.05, repeats: true) { [weak self] _ in
-            self?.fetchAudioLevel()
-        }
+        let socket = apiClient.levelSocket()
+        levelSocket = socket
+        receiveAudioLevel(on: socket)
     }
 
-    func stopLevelPolling() {
-        levelTimer?.invalidate()
-        levelTimer = nil
+    func stopLevelUpdates() {
+        levelSocket?.cancel(with: .goingAway, reason: nil)
+        levelSocket = nil
     }
 
-    func fetchAudioLevel() {
-        Task {
-            do {
-                let level = try await apiClient.getLevel()
-                await MainActor.run {
-                    audioLevel = level.level
-                    levelHistory.append(min(level.level * 10, 1.0))
-                    if levelHistory.count > 30 {
-                        levelHistory.removeFirst()
+    func receiveAudioLevel(on socket: URLSessionWebSocketTask) {
+        socket.receive { [weak self] result in
+            // Socket closed or failed - level display is non-critical
+            guard let self = self, case .success(let message) = result else { return }
+
+            if case .string(let text) = message,
+               let level = try? JSONDecoder().decode(APIClient.LevelResponse.self, from: Data(text.utf8)) {
+                DispatchQueue.main.async {
+                    self.audioLevel = level.level
+                    self.levelHistory.append(min(level.level * 10, 1.0))
+                    if self.levelHistory.count > 30 {
+                        self.levelHistory.removeFirst()
                     }
                 }
-            } catch {
-                // Silently ignore level fetch errors - non-critical
             }
+            self.receiveAudioLevel(on: socket)
         }
     }
 
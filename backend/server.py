@@ -8,30 +8,46 @@ Endpoints:
   POST /save          - Save training data
   POST /cancel        - Cancel current transcription
   GET  /status        - Get current status
+  WS   /ws/level      - Push audio levels while recording
 """
 
-import subprocess
-import tempfile
-import wave
-import shutil
-import json
 import os
+import asyncio
+import math
+import struct
+import threading
 from pathlib import Path
 from datetime import datetime
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import orjson
 import sounddevice as sd
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import uvicorn
 
+from transcriber import load_engine, speech_only
+
 # Paths
 APP_DIR = Path(__file__).parent.parent
-MODEL_PATH = APP_DIR / "models" / "ggml-medium.bin"
 DATA_DIR = APP_DIR / "training_data"
+COUNTER_PATH = DATA_DIR / ".counter"
 SAMPLE_RATE = 16000
+MAX_RECORDING_SECONDS = 300  # initial capture buffer; grows if exceeded
+INT16_SCALE = np.float32(1 / 32768)
+# Recordings shorter or quieter than this are accidental taps; skip the model
+MIN_SPEECH_SECONDS = 0.4
+SILENCE_RMS = 0.005
+BLOCKSIZE = 1600  # frames per read (100 ms): 10 reader wakeups a second
+READER_JOIN_TIMEOUT = 1.0  # seconds close_stream() waits for the reader thread
+# Pretty-print saved metadata JSON (off by default: compact is cheaper to write)
+PRETTY_JSON = os.environ.get("PANOKEET_PRETTY_JSON", "").lower() in ("1", "true", "yes")
+LEVEL_PUSH_INTERVAL = BLOCKSIZE / SAMPLE_RATE  # one /ws/level push per block
+LEVEL_IDLE_TIMEOUT = 10  # idle keepalive; also notices closed sockets
 
 
 class RecorderState:
@@ -39,47 +55,84 @@ class RecorderState:
 
     def __init__(self):
         self.recording = False
-        self.audio_data = []
+        self._buf = np.empty(SAMPLE_RATE * MAX_RECORDING_SECONDS, dtype=np.int16)
+        self._w = 0
+        # Guards the _buf/_w handoff between the reader thread and the event loop
+        self._buf_lock = threading.Lock()
+        self._scratch = np.empty(0, dtype=np.float32)
         self.stream = None
-        self.temp_audio_path = None
+        self._reader = None
+        self._abandoned_reader = None
+        self._reading = False
+        self.has_input = False
+        self.pending_audio = None
         self.last_transcript = None
         self.last_duration = None
-        self.current_level = 0.0
+        # Bumped per recording; results of older ones are never published
+        self.generation = 0
+        self._level_sq = 0.0
+        self.engine = None
+        # Set while recording; wakes idle /ws/level senders
+        self.active = asyncio.Event()
+
+    @property
+    def current_level(self):
+        """RMS input level; the square root is only taken when polled."""
+        return math.sqrt(self._level_sq)
+
+    def load_model(self):
+        """Load the Whisper engine once and run a second of silence through it
+        (bypassing VAD), so weights are paged in before the first real dictation."""
+        self.engine = load_engine()
+        self.engine.warm_up()
+
+    def refresh_devices(self):
+        """Re-enumerate CoreAudio devices and cache whether any can record.
+
+        PortAudio fixes its device list at initialization, so it is
+        re-initialized to see hot-plugged mics; that invalidates open
+        streams, so ours is closed first (open_stream() reopens it).
+        """
+        self.close_stream()
+        stuck = self._abandoned_reader
+        if stuck is not None and stuck.is_alive():
+            # Terminating PortAudio under its live read could free the stream
+            # it is still inside; keep the old device list instead
+            print("⚠️ Audio reader still stuck; not re-initializing PortAudio")
+        else:
+            self._abandoned_reader = None
+            reinitialize_portaudio()
+        self.has_input = any(d['max_input_channels'] > 0 for d in sd.query_devices())
+        return self.has_input
 
     def start_recording(self):
         if self.recording:
             return {"success": False, "error": "Already recording"}
 
-        self.audio_data = []
-        self.temp_audio_path = None
+        with self._buf_lock:
+            if self._buf is None:
+                self._buf = np.empty(SAMPLE_RATE * MAX_RECORDING_SECONDS, dtype=np.int16)
+            self._w = 0
+        self.generation += 1
+        self.pending_audio = None
         self.last_transcript = None
-        self.current_level = 0.0
-
-        def callback(indata, frames, t, status):
-            if self.recording:
-                self.audio_data.append(indata.copy())
-                self.current_level = float(np.sqrt(np.mean(indata**2)))
+        self._level_sq = 0.0
 
         try:
-            # Check for available input devices first
-            devices = sd.query_devices()
-            input_devices = [d for d in devices if d['max_input_channels'] > 0]
-            if not input_devices:
+            # Check for available input devices first (cached; only re-queried
+            # when none were found or PortAudio reports an error)
+            if not self.has_input and not self.refresh_devices():
                 print("❌ No audio input devices found")
                 return {"success": False, "error": "No audio input device found. Please connect a microphone."}
 
-            self.stream = sd.InputStream(
-                samplerate=SAMPLE_RATE,
-                channels=1,
-                dtype=np.float32,
-                callback=callback
-            )
-            self.stream.start()
+            self.open_stream()
             self.recording = True
+            self.active.set()
             print("🔴 Recording started")
             return {"success": True}
 
         except sd.PortAudioError as e:
+            self.refresh_devices()
             error_msg = str(e)
             if "device" in error_msg.lower():
                 print(f"❌ Audio device error: {e}")
@@ -90,98 +143,279 @@ class RecorderState:
             print(f"❌ Recording error: {e}")
             return {"success": False, "error": f"Failed to start recording: {e}"}
 
+    def _read_loop(self, stream):
+        """Pull blocks with blocking reads on our own thread, so no Python
+        runs on PortAudio's real-time thread (and it never waits on the GIL)."""
+        try:
+            while self._reading:
+                data, _ = stream.read(BLOCKSIZE)
+                self._consume(data, BLOCKSIZE)
+        except sd.PortAudioError as e:
+            if self._reading:  # not just close_stream() aborting us
+                print(f"⚠️ Audio input stopped: {e}")
+                self.has_input = False
+        except Exception as e:
+            # Never die silently: open_stream() restarts a dead reader
+            print(f"❌ Audio reader error: {e!r}")
+
+    def _consume(self, indata, frames):
+        samples = np.frombuffer(indata, dtype=np.int16)
+        with self._buf_lock:
+            # The stream runs between recordings too; drop those blocks
+            buf = self._buf
+            if not self.recording or buf is None:
+                return
+            end = self._w + frames
+            if end > len(buf):
+                buf = self._grow(end)
+            buf[self._w:end] = samples
+            self._w = end
+
+        # Level in float (int16 dot products overflow); scratch is reused
+        if len(self._scratch) < frames:
+            self._scratch = np.empty(frames, dtype=np.float32)
+        scaled = self._scratch[:frames]
+        np.multiply(samples, INT16_SCALE, out=scaled)
+        energy = float(np.dot(scaled, scaled)) / frames
+        self._level_sq = 0.7 * self._level_sq + 0.3 * energy
+
+    def _grow(self, needed):
+        """Double the capture buffer (only hit on very long recordings).
+        Caller holds _buf_lock."""
+        buf = np.empty(max(needed, 2 * len(self._buf)), dtype=np.int16)
+        buf[:self._w] = self._buf[:self._w]
+        self._buf = buf
+        return buf
+
+    def open_stream(self):
+        """Open the input stream if needed. It is left running, so recording
+        starts on the next block instead of after CoreAudio setup."""
+        if self.stream is not None and self.stream.active and self._reader.is_alive():
+            return
+        self.close_stream()
+        self.stream = sd.RawInputStream(
+            samplerate=SAMPLE_RATE,
+            channels=1,
+            dtype='int16',
+            blocksize=BLOCKSIZE,
+            latency='low'
+        )
+        self.stream.start()
+        self._reading = True
+        self._reader = threading.Thread(target=self._read_loop, args=(self.stream,), daemon=True)
+        self._reader.start()
+
+    def close_stream(self):
+        """Close the input stream (on shutdown or after a device error)."""
+        # Abort first so a read blocked on a stalled device returns, then
+        # wait (bounded: this runs on the event loop) before closing under it
+        self._reading = False
+        if self.stream:
+            try:
+                self.stream.abort()
+            except sd.PortAudioError:
+                pass
+        if self._reader is not None:
+            self._reader.join(READER_JOIN_TIMEOUT)
+            if self._reader.is_alive():
+                # Closing now could free the stream mid-read; leak it instead
+                print("⚠️ Audio reader is stuck; abandoning the input stream")
+                self._abandoned_reader = self._reader
+                self.stream = None
+            self._reader = None
+        if self.stream:
+            try:
+                self.stream.close()
+            except sd.PortAudioError:
+                pass
+            self.stream = None
+
     def stop_recording(self):
         if not self.recording:
             return None, 0
 
-        self.recording = False
-
-        if self.stream:
-            self.stream.stop()
-            self.stream.close()
-            self.stream = None
-
-        if not self.audio_data:
+        with self._buf_lock:
+            self.recording = False
+            if not self._w:
+                audio = None
+            else:
+                # Hand the buffer to the caller: transcription runs in a worker
+                # thread and may still be reading it when the next recording starts.
+                audio = self._buf[:self._w]
+                self._buf = None
+        self.active.clear()
+
+        if audio is None:
             print("No audio captured")
             return None, 0
 
-        # Concatenate audio
-        audio = np.concatenate(self.audio_data, axis=0)
         duration = len(audio) / SAMPLE_RATE
 
-        # Save to temp file
-        temp = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        self.temp_audio_path = temp.name
-        audio_int16 = (audio * 32767).astype(np.int16)
-        with wave.open(temp.name, 'wb') as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(SAMPLE_RATE)
-            wf.writeframes(audio_int16.tobytes())
-
         print(f"⏹ Recording stopped ({duration:.1f}s)")
-        return self.temp_audio_path, duration
+        return audio, duration
 
-    def transcribe(self, audio_path):
-        """Transcribe audio using whisper-cli."""
+    def transcribe(self, audio):
+        """Transcribe an int16 recording with the in-process Whisper engine."""
         print("⏳ Transcribing...")
 
         try:
-            result = subprocess.run(
-                ["/opt/homebrew/bin/whisper-cli", "-m", str(MODEL_PATH), "-f", audio_path,
-                 "--no-timestamps", "-t", "4", "-l", "en"],
-                capture_output=True, text=True, timeout=120
-            )
-
-            if result.returncode != 0:
-                print(f"❌ whisper-cli failed (code {result.returncode})")
-                if result.stderr:
-                    print(f"   stderr: {result.stderr[:500]}")
+            if len(audio) < MIN_SPEECH_SECONDS * SAMPLE_RATE:
+                print("🤫 Too short to transcribe")
+                return None
+
+            # Engines take float32; convert once, scaling the copy in place
+            audio = audio.astype(np.float32)
+            audio *= INT16_SCALE
+            if math.sqrt(float(np.dot(audio, audio)) / len(audio)) < SILENCE_RMS:
+                print("🤫 No speech detected")
+                return None
+            if not self.engine.has_vad:
+                audio = speech_only(audio)
+                if audio is None:
+                    print("🤫 No speech detected")
+                    return None
+
+            text = self.engine.transcribe(audio)
+            if not text:
                 return None
 
-            text = ' '.join([l.strip() for l in result.stdout.strip().split('\n') if l.strip()])
-            self.last_transcript = text
             print(f"📝 {text}")
             return text
 
-        except subprocess.TimeoutExpired:
-            print("❌ Transcription timed out (>120s)")
-            return None
-        except FileNotFoundError:
-            print("❌ whisper-cli not found at /opt/homebrew/bin/whisper-cli")
-            return None
         except Exception as e:
             print(f"❌ Transcription error: {e}")
             return None
 
-    def cleanup_temp(self):
-        """Remove temporary audio file."""
-        if self.temp_audio_path and os.path.exists(self.temp_audio_path):
-            os.unlink(self.temp_audio_path)
-            self.temp_audio_path = None
+    def publish(self, generation, audio, duration, transcript):
+        """Make a finished transcription the one awaiting review, keeping audio
+        and text together. Returns False if a newer recording has started since
+        (its result would otherwise be paired with the wrong audio)."""
+        if generation != self.generation:
+            print("⏭ Newer recording started; dropping this transcript")
+            return False
+        # Kept in memory; the WAV is only written if the user saves
+        self.pending_audio = audio
+        self.last_transcript = transcript
+        self.last_duration = duration
+        return True
+
+    def discard_pending(self):
+        """Drop the recording awaiting save."""
+        self.pending_audio = None
+
+
+def reinitialize_portaudio():
+    """Restart PortAudio so it rebuilds its device list, which is otherwise
+    fixed at initialization. Invalidates every open stream.
+
+    sounddevice has no public API for this: _terminate() and _initialize()
+    are private module functions (present in sounddevice 0.4 and 0.5, which
+    pyproject.toml requires). If a future release drops them, the device
+    list just stays as it was at startup.
+    """
+    terminate = getattr(sd, "_terminate", None)
+    initialize = getattr(sd, "_initialize", None)
+    if terminate is None or initialize is None:
+        return False
+    terminate()
+    initialize()
+    return True
 
 
 # Global state
 recorder = RecorderState()
+# One thread owns the engine: transcriptions queue up in order instead of
+# running concurrently on a model that isn't thread-safe, while recording
+# stays free to start again immediately (only the newest recording's result
+# is published, see RecorderState.publish)
+transcribe_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcribe")
+
+
+async def run_transcription(audio):
+    """Queue a recording for the transcription thread and await the text."""
+    return await asyncio.get_running_loop().run_in_executor(transcribe_pool, recorder.transcribe, audio)
+
+
+def load_next_id():
+    """Next training-data id from the counter file, scanning DATA_DIR only if it's missing."""
+    try:
+        return int(COUNTER_PATH.read_text())
+    except (FileNotFoundError, ValueError):
+        # One readdir, no Path objects; names are audio_NNNNNN.wav
+        with os.scandir(DATA_DIR) as entries:
+            nums = [int(e.name[6:12]) for e in entries
+                    if e.name.startswith("audio_") and e.name.endswith(".wav") and e.name[6:12].isdigit()]
+        return max(nums, default=0) + 1
+
+
+def store_next_id(next_id):
+    """Persist the counter atomically so a crash mid-write can't corrupt it."""
+    tmp_path = COUNTER_PATH.with_name(COUNTER_PATH.name + ".tmp")
+    tmp_path.write_text(str(next_id))
+    os.replace(tmp_path, COUNTER_PATH)
+
+
+def write_wav(path, audio):
+    """Write int16 audio to a temp name in DATA_DIR and rename it into place,
+    so a half-written WAV is never visible."""
+    tmp_path = path.with_suffix(".wav.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(wav_header(len(audio)))
+        f.write(memoryview(audio))  # buffer protocol: no tobytes() copy
+    os.replace(tmp_path, path)
+
+
+def wav_header(num_samples):
+    """44-byte RIFF header for 16-bit mono PCM at SAMPLE_RATE."""
+    data_size = num_samples * 2
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16,
+                       b'data', data_size)
+
+
+async def write_training_data(num, audio, json_bytes, text, duration):
+    """Write the WAV, metadata JSON and plain-text transcript concurrently."""
+    stem = DATA_DIR / f"audio_{num:06d}"
+    writes = [
+        asyncio.to_thread(stem.with_suffix(".json").write_bytes, json_bytes),
+        asyncio.to_thread(stem.with_suffix(".txt").write_bytes, text.encode()),
+    ]
+    if audio is not None:
+        writes.append(asyncio.to_thread(write_wav, stem.with_suffix(".wav"), audio))
+    await asyncio.gather(*writes)
+    print(f"💾 Saved audio_{num:06d} ({duration:.1f}s)")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
     DATA_DIR.mkdir(exist_ok=True)
+    app.state.next_id = load_next_id()
+    app.state.save_lock = asyncio.Lock()
+    await asyncio.get_running_loop().run_in_executor(transcribe_pool, recorder.load_model)
+    if recorder.refresh_devices():
+        try:
+            recorder.open_stream()
+        except sd.PortAudioError as e:
+            print(f"⚠️ Could not open audio input yet: {e}")
     print(f"\n{'='*50}")
     print("🦜 PANOKEET BACKEND")
     print(f"{'='*50}")
-    print(f"Model: {MODEL_PATH.name}")
+    print(f"Engine: {recorder.engine.name}")
+    print(f"Model: {recorder.engine.model_name}")
     print(f"Data: {DATA_DIR}/")
     print(f"API: http://localhost:8765")
     print(f"{'='*50}\n")
     yield
     # Cleanup on shutdown
-    recorder.cleanup_temp()
+    recorder.discard_pending()
+    recorder.close_stream()
+    transcribe_pool.shutdown()
+    recorder.engine.close()
 
 
-app = FastAPI(title="Panokeet Backend", lifespan=lifespan)
+app = FastAPI(title="Panokeet Backend", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Allow CORS for SwiftUI app
 app.add_middleware(
@@ -215,16 +449,17 @@ async def toggle_recording():
     """Toggle recording on/off."""
     if recorder.recording:
         # Stop and transcribe
-        audio_path, duration = recorder.stop_recording()
-        if not audio_path:
+        audio, duration = recorder.stop_recording()
+        if audio is None:
             return {"status": "ready", "action": "stopped", "error": "No audio"}
 
-        recorder.last_duration = duration
-        transcript = recorder.transcribe(audio_path)
+        generation = recorder.generation
+        transcript = await run_transcription(audio)
 
         if not transcript:
-            recorder.cleanup_temp()
             return {"status": "ready", "action": "stopped", "error": "No speech"}
+        if not recorder.publish(generation, audio, duration, transcript):
+            return {"status": "ready", "action": "stopped", "error": "Superseded by a newer recording"}
 
         return {"status": "transcribed", "action": "stopped", "transcript": transcript, "duration": duration}
     else:
@@ -253,40 +488,35 @@ async def stop_recording() -> TranscriptResult:
     if not recorder.recording:
         raise HTTPException(status_code=400, detail="Not recording")
 
-    audio_path, duration = recorder.stop_recording()
+    audio, duration = recorder.stop_recording()
 
-    if not audio_path:
+    if audio is None:
         raise HTTPException(status_code=400, detail="No audio captured")
 
-    recorder.last_duration = duration
-
     # Transcribe
-    transcript = recorder.transcribe(audio_path)
+    generation = recorder.generation
+    transcript = await run_transcription(audio)
 
     if not transcript:
-        recorder.cleanup_temp()
         raise HTTPException(status_code=400, detail="No speech detected")
+    if not recorder.publish(generation, audio, duration, transcript):
+        raise HTTPException(status_code=409, detail="Superseded by a newer recording")
 
     return TranscriptResult(transcript=transcript, duration=duration)
 
 
 @app.post("/save")
-async def save_transcript(request: SaveRequest):
+async def save_transcript(request: SaveRequest, background_tasks: BackgroundTasks):
     """Save training data (audio + metadata)."""
     DATA_DIR.mkdir(exist_ok=True)
 
     # Get next number
-    existing = list(DATA_DIR.glob("audio_*.wav"))
-    nums = [int(f.stem.split('_')[1]) for f in existing if f.stem.split('_')[1].isdigit()]
-    num = max(nums, default=0) + 1
-
-    # Move audio file
-    audio_path = DATA_DIR / f"audio_{num:06d}.wav"
-    if recorder.temp_audio_path and os.path.exists(recorder.temp_audio_path):
-        shutil.move(recorder.temp_audio_path, str(audio_path))
-        recorder.temp_audio_path = None
+    async with app.state.save_lock:
+        num = app.state.next_id
+        app.state.next_id += 1
+        store_next_id(app.state.next_id)
 
-    # Save metadata JSON
+    # Metadata JSON
     metadata = {
         "timestamp": datetime.now().isoformat(),
         "duration": round(request.duration, 2),
@@ -295,22 +525,20 @@ async def save_transcript(request: SaveRequest):
         "was_edited": request.was_edited,
         "needs_review": not request.was_edited
     }
-    json_path = DATA_DIR / f"audio_{num:06d}.json"
-    with open(json_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    json_bytes = orjson.dumps(metadata, option=orjson.OPT_INDENT_2 if PRETTY_JSON else None)
 
-    # Also save plain text
-    txt_path = DATA_DIR / f"audio_{num:06d}.txt"
-    txt_path.write_text(request.final_text)
-
-    print(f"💾 Saved audio_{num:06d} ({request.duration:.1f}s)")
+    # Files are written after the response is sent, so the UI isn't kept
+    # waiting on the disk
+    audio, recorder.pending_audio = recorder.pending_audio, None
+    background_tasks.add_task(write_training_data, num, audio, json_bytes,
+                              request.final_text, request.duration)
     return {"status": "saved", "id": num}
 
 
 @app.post("/cancel")
 async def cancel_transcript():
     """Cancel current transcription and cleanup."""
-    recorder.cleanup_temp()
+    recorder.discard_pending()
     print("❌ Cancelled")
     return {"status": "cancelled"}
 
@@ -326,7 +554,7 @@ async def get_status() -> StatusResponse:
 @app.get("/pending")
 async def get_pending():
     """Get pending transcript for UI to display."""
-    if recorder.last_transcript and recorder.temp_audio_path:
+    if recorder.last_transcript and recorder.pending_audio is not None:
         return {
             "pending": True,
             "transcript": recorder.last_transcript,
@@ -341,10 +569,29 @@ async def get_level():
     return {"level": recorder.current_level, "recording": recorder.recording}
 
 
+@app.websocket("/ws/level")
+async def level_socket(websocket: WebSocket):
+    """Push audio levels while recording, instead of polling /level."""
+    await websocket.accept()
+    try:
+        while True:
+            await websocket.send_json({"level": recorder.current_level, "recording": recorder.recording})
+            if recorder.recording:
+                await asyncio.sleep(LEVEL_PUSH_INTERVAL)
+                continue
+            # Idle: sleep until a recording starts instead of sending zeros
+            try:
+                await asyncio.wait_for(recorder.active.wait(), LEVEL_IDLE_TIMEOUT)
+            except TimeoutError:
+                pass
+    except WebSocketDisconnect:
+        pass
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint."""
-    return {"status": "ok", "model": MODEL_PATH.name}
+    return {"status": "ok", "engine": recorder.engine.name, "model": recorder.engine.model_name}
 
 
 def main():
@@ -354,7 +601,10 @@ def main():
         host="127.0.0.1",
         port=8765,
         reload=False,
-        log_level="warning"
+        log_level="warning",
+        loop="uvloop",
+        http="httptools",
+        access_log=False
     )
 
 
@@ -0,0 +1,391 @@
+"""
+Panokeet transcription engines
+
+Each engine loads its Whisper model once and exposes
+transcribe(audio) -> str for a mono float32 buffer at 16 kHz, plus
+warm_up() to run the model once (VAD bypassed) before real audio.
+Engines without has_vad expect callers to cut silence first with
+speech_only().
+
+  MLXWhisperEngine      - mlx-whisper on the Apple Silicon GPU (preferred)
+  FasterWhisperEngine   - faster-whisper / CTranslate2 on CPU or CUDA
+  WhisperCppEngine      - whisper.cpp linked in-process via pywhispercpp
+  WhisperServerEngine   - persistent whisper.cpp whisper-server over HTTP
+
+Set PANOKEET_ENGINE=mlx|faster-whisper|whisper.cpp|whisper-server to
+override the default. whisper.cpp falls back to whisper-server when
+pywhispercpp is not installed. config.json may set "language" and, for
+the whisper.cpp engines, the ggml "model" file in models/
+(PANOKEET_MODEL overrides it).
+"""
+
+import io
+import os
+import math
+import time
+import socket
+import atexit
+import shutil
+import platform
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import httpx
+import orjson
+import soundfile as sf
+import ctranslate2
+from faster_whisper import WhisperModel
+from faster_whisper.vad import get_speech_timestamps
+
+try:
+    import mlx_whisper
+except ImportError:
+    mlx_whisper = None
+
+try:
+    from pywhispercpp.model import Model as WhisperCppModel
+except ImportError:
+    WhisperCppModel = None
+
+APP_DIR = Path(__file__).parent.parent
+CONFIG_PATH = APP_DIR / "config.json"
+
+
+def load_config():
+    """Settings from config.json (see SETUP.md); a missing file means defaults."""
+    try:
+        return orjson.loads(CONFIG_PATH.read_bytes())
+    except FileNotFoundError:
+        return {}
+    except orjson.JSONDecodeError as e:
+        print(f"⚠️ Ignoring {CONFIG_PATH.name}, not valid JSON: {e}")
+        return {}
+
+
+def config_beam_size():
+    """beam_size from config.json as an int >= 1 (1, greedy, if unset)."""
+    value = CONFIG.get("beam_size", 1)
+    try:
+        beam_size = int(value)
+    except (TypeError, ValueError):
+        print(f"⚠️ beam_size {value!r} is not a number, using 1")
+        return 1
+    if beam_size < 1:
+        print(f"⚠️ beam_size {value!r} is below 1, using 1")
+        return 1
+    return beam_size
+
+
+CONFIG = load_config()
+LANGUAGE = CONFIG.get("language", "en")
+# Greedy by default: beam search buys little for dictation at ~5x the decoder work
+BEAM_SIZE = config_beam_size()
+SAMPLE_RATE = 16000
+SPLIT_SECONDS = 30  # whisper.cpp splits longer clips across processors
+
+# faster-whisper (CTranslate2)
+FW_MODEL = "medium"
+# Quantized weights first (here and in GGML_QUANT_TYPES): decoding is memory-bandwidth-bound
+FW_COMPUTE_TYPES = ["int8_float16", "int8", "int8_float32", "float16", "float32"]
+
+# mlx-whisper (weights pulled from the Hugging Face cache)
+MLX_REPO = "mlx-community/whisper-medium-mlx-q4"
+
+# whisper.cpp (pywhispercpp or Homebrew whisper-server, ggml weights)
+WHISPER_SERVER = "/opt/homebrew/bin/whisper-server"
+MODELS_DIR = APP_DIR / "models"
+GGML_MODEL = "ggml-medium.bin"  # setup.sh may symlink this to another size
+GGML_QUANT_TYPES = ["q5_k", "q5_0", "q8_0"]  # preferred order; first is made on first run
+VAD_MODEL_PATH = MODELS_DIR / "ggml-silero-v5.1.2.bin"
+WHISPER_SERVER_STARTUP_TIMEOUT = 60
+
+
+class FasterWhisperEngine:
+    """Whisper via CTranslate2 with quantized weights."""
+
+    name = "faster-whisper"
+    has_vad = True
+
+    def __init__(self):
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        compute_type = pick_compute_type(device)
+        self.model_name = f"{FW_MODEL} ({compute_type}, {device})"
+        self.model = WhisperModel(FW_MODEL, device=device, compute_type=compute_type,
+                                  cpu_threads=PERF_CORES)
+
+    def transcribe(self, audio):
+        segments, _ = self.model.transcribe(
+            audio, language=LANGUAGE, beam_size=BEAM_SIZE, vad_filter=True
+        )
+        return ' '.join(s.text.strip() for s in segments if s.text.strip())
+
+    def warm_up(self):
+        # vad_filter would cut the silent clip before the encoder ever ran
+        segments, _ = self.model.transcribe(
+            warm_up_audio(), language=LANGUAGE, beam_size=BEAM_SIZE, vad_filter=False
+        )
+        list(segments)  # decoding is lazy
+
+    def close(self):
+        pass
+
+
+class MLXWhisperEngine:
+    """Whisper on the Apple Silicon GPU via MLX (Metal kernels)."""
+
+    name = "mlx-whisper"
+    has_vad = False
+
+    def __init__(self):
+        if mlx_whisper is None:
+            raise RuntimeError("mlx-whisper is not installed")
+        self.model_name = MLX_REPO
+
+    def transcribe(self, audio):
+        result = mlx_whisper.transcribe(audio, path_or_hf_repo=MLX_REPO, language=LANGUAGE)
+        return result["text"].strip()
+
+    def warm_up(self):
+        self.transcribe(warm_up_audio())
+
+    def close(self):
+        pass
+
+
+class WhisperCppEngine:
+    """whisper.cpp in-process: the ggml model stays resident, no WAV or HTTP hop."""
+
+    name = "whisper.cpp"
+    has_vad = False
+
+    def __init__(self):
+        model_path = find_ggml_model()
+        self.model_name = model_path.name
+        if coreml_encoder(model_path):
+            self.model_name += " (Core ML encoder found)"
+        self.model = WhisperCppModel(
+            str(model_path), n_threads=PERF_CORES, language=LANGUAGE,
+            print_progress=False, print_realtime=False
+        )
+
+    def transcribe(self, audio):
+        threads, processors = choose_split(len(audio) / SAMPLE_RATE)
+        segments = self.model.transcribe(audio, n_processors=processors, n_threads=threads)
+        return ' '.join(s.text.strip() for s in segments if s.text.strip())
+
+    def warm_up(self):
+        self.transcribe(warm_up_audio())
+
+    def close(self):
+        pass
+
+
+class WhisperServerEngine:
+    """whisper.cpp kept resident in a whisper-server child process."""
+
+    name = "whisper-server"
+
+    def __init__(self):
+        model_path = find_ggml_model()
+        self.model_name = model_path.name
+        if coreml_encoder(model_path):
+            self.model_name += " (Core ML encoder found)"
+        # Fresh port each launch: an orphan from a killed backend keeps its old one
+        port = free_port()
+        args = [WHISPER_SERVER, "-m", str(model_path),
+                "--host", "127.0.0.1", "--port", str(port),
+                "-t", str(PERF_CORES), "-bs", str(BEAM_SIZE), "-bo", "1"]
+        self.has_vad = VAD_MODEL_PATH.exists()
+        if self.has_vad:
+            args += ["--vad", "--vad-model", str(VAD_MODEL_PATH)]
+            self.model_name += " + VAD"
+        self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(self.close)
+        self.client = httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120)
+        self._wait_until_ready()
+
+    def _wait_until_ready(self):
+        """Block until whisper-server has loaded the model and is listening."""
+        deadline = time.monotonic() + WHISPER_SERVER_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"whisper-server exited (code {self.process.returncode})")
+            try:
+                self.client.get("/")
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError("whisper-server did not start in time")
+
+    def transcribe(self, audio, **params):
+        response = self.client.post(
+            "/inference",
+            files={"file": ("audio.wav", to_wav_bytes(audio), "audio/wav")},
+            data={"language": LANGUAGE, "response_format": "json", **params},
+        )
+        response.raise_for_status()
+        # str.split() collapses newlines and runs of spaces in one C pass
+        return ' '.join(orjson.loads(response.content)["text"].split())
+
+    def warm_up(self):
+        # Per-request override: with --vad the silent clip never reaches the encoder
+        self.transcribe(warm_up_audio(), vad="false")
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def speech_only(audio):
+    """Keep only the speech regions (Silero VAD bundled with faster-whisper).
+
+    Returns None when no speech is found, so the model can be skipped.
+    """
+    spans = get_speech_timestamps(audio, sampling_rate=SAMPLE_RATE)
+    if not spans:
+        return None
+    if len(spans) == 1:
+        return audio[spans[0]["start"]:spans[0]["end"]]
+    return np.concatenate([audio[s["start"]:s["end"]] for s in spans])
+
+
+def warm_up_audio():
+    """One second of silence for warm_up(): enough to run every layer once."""
+    return np.zeros(SAMPLE_RATE, dtype=np.float32)
+
+
+def find_ggml_model():
+    """The model from PANOKEET_MODEL or config.json if present, else prefer a
+    quantized ggml model, quantizing the fp16 one on first run if possible."""
+    name = os.environ.get("PANOKEET_MODEL") or CONFIG.get("model")
+    # Older SETUP.md told users to put the fp16 name in config.json; treat it
+    # as "auto" so those configs still get the quantized model
+    if name == GGML_MODEL:
+        name = None
+    if name:
+        configured = MODELS_DIR / name
+        if configured.exists():
+            return configured
+        print(f"⚠️ {configured} not found, picking a model automatically")
+
+    # Quantized files are named after the symlink target, so picking another
+    # model in setup.sh never reuses weights quantized from the old one
+    source = (MODELS_DIR / GGML_MODEL).resolve()
+    quantized = [source.with_name(f"{source.stem}-{q}.bin") for q in GGML_QUANT_TYPES]
+    for path in quantized:
+        if path.exists():
+            return path
+
+    quantize = shutil.which("whisper-quantize")
+    if quantize and source.exists():
+        target = quantized[0]
+        # Quantize under a temp name: a killed backend must not leave a
+        # truncated model that would be picked up on every later start
+        tmp_path = target.with_name(target.name + ".tmp")
+        print(f"⏳ Quantizing {source.name} to {GGML_QUANT_TYPES[0]} (one-time)...")
+        result = subprocess.run([quantize, str(source), str(tmp_path), GGML_QUANT_TYPES[0]],
+                                capture_output=True, text=True)
+        if result.returncode == 0:
+            os.replace(tmp_path, target)
+            return target
+        print(f"❌ whisper-quantize failed (code {result.returncode}), using {source.name}")
+        tmp_path.unlink(missing_ok=True)
+    return source
+
+
+def coreml_encoder(model_path):
+    """The Core ML encoder whisper.cpp loads next to a ggml model, if present.
+
+    Builds with Core ML support pick it up automatically and run the
+    encoder on the Neural Engine; other builds (e.g. Homebrew's) ignore
+    it. Like whisper.cpp, drop any -qX_Y quantization suffix from the name.
+    """
+    stem = model_path.stem
+    if stem[-5:-3] == "-q" and stem[-2] == "_":
+        stem = stem[:-5]
+    encoder = model_path.with_name(f"{stem}-encoder.mlmodelc")
+    return encoder if encoder.exists() else None
+
+
+def free_port():
+    """An unused loopback port, so a leftover whisper-server can never answer for ours."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def count_perf_cores():
+    """Performance cores on Apple Silicon (E-cores slow whisper down), else all cores."""
+    if platform.system() == "Darwin":
+        result = subprocess.run(["sysctl", "-n", "hw.perflevel0.physicalcpu"],
+                                capture_output=True, text=True)
+        if result.returncode == 0 and result.stdout.strip().isdigit():
+            return int(result.stdout)
+    return os.cpu_count() or 4
+
+
+PERF_CORES = count_perf_cores()
+
+
+def choose_split(duration):
+    """(threads, processors) for whisper.cpp; clips past SPLIT_SECONDS run in parallel chunks."""
+    processors = min(math.ceil(duration / SPLIT_SECONDS), PERF_CORES // 2)
+    processors = max(processors, 1)
+    return PERF_CORES // processors, processors
+
+
+def to_wav_bytes(audio):
+    """Encode a float32 buffer as an in-memory 16-bit mono WAV.
+
+    libsndfile does not clip by default, so samples must already be in
+    [-1, 1); they are, since every caller's audio was scaled from int16.
+    """
+    buf = io.BytesIO()
+    sf.write(buf, audio, SAMPLE_RATE, format='WAV', subtype='PCM_16')
+    return buf.getvalue()
+
+
+def pick_compute_type(device):
+    """Smallest weight format CTranslate2 supports on this device."""
+    supported = ctranslate2.get_supported_compute_types(device)
+    for compute_type in FW_COMPUTE_TYPES:
+        if compute_type in supported:
+            return compute_type
+    return "default"
+
+
+def is_apple_silicon():
+    return platform.system() == "Darwin" and platform.machine() == "arm64"
+
+
+def load_whisper_cpp():
+    """In-process whisper.cpp when the bindings are installed, else whisper-server."""
+    if WhisperCppModel is not None:
+        return WhisperCppEngine()
+    return WhisperServerEngine()
+
+
+ENGINES = {
+    "mlx": MLXWhisperEngine,
+    "faster-whisper": FasterWhisperEngine,
+    "whisper.cpp": load_whisper_cpp,
+    "whisper-server": WhisperServerEngine,
+}
+
+
+def load_engine():
+    """Load the engine named by PANOKEET_ENGINE, else the fastest available."""
+    name = os.environ.get("PANOKEET_ENGINE")
+    if name:
+        if name not in ENGINES:
+            raise ValueError(f"Unknown PANOKEET_ENGINE {name!r} (choose from {', '.join(ENGINES)})")
+        return ENGINES[name]()
+    if mlx_whisper is not None and is_apple_silicon():
+        return MLXWhisperEngine()
+    return FasterWhisperEngine()
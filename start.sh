@@ -12,6 +12,7 @@ launchctl unload ~/Library/LaunchAgents/com.panokeet.backend.plist 2>/dev/null
 pkill -9 -f "PanokeetUI" 2>/dev/null
 pkill -9 -f "server.py" 2>/dev/null
 pkill -9 -f "uvicorn" 2>/dev/null
+pkill -9 -f "whisper-server" 2>/dev/null  # child of a killed backend is orphaned
 
 # Force kill anything on port 8765, retry until clear
 for i in {1..5}; do